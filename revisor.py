@@ -2,12 +2,21 @@
 """
 Revises text from the clipboard using a large language model.
 """
-import os, sys, time, subprocess, json, datetime
+from __future__ import annotations
+import os, sys, time, subprocess, json, atexit, logging, queue, urllib.request
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from subprocess import CalledProcessError, TimeoutExpired
+from shutil import which
+from urllib.error import HTTPError
+from subprocess import TimeoutExpired
+
+T0 = time.monotonic_ns()  # log lines are stamped relative to process start
 
 PROMPT_FILE = Path.home() / ".revisor"
 LOG_FILE    = Path.home() / ".revisor.log"
+CACHE_FILE  = Path.home() / ".revisor.cache.json"
 
 def _keyring(service, key):
     """Fetch a secret from GNOME Keyring via secret-tool (None if absent)."""
@@ -18,146 +27,275 @@ def _keyring(service, key):
     except Exception:
         return None
 
-MODEL   = os.getenv("REVISOR_MODEL", "gpt-5")
-# Secrets migrated from ~/.secrets to GNOME Keyring (2026-06): use the env var
-# if set, else fetch from the keyring (service=revisor key=api-key). The keyring
-# path works regardless of launch context (i3, shell, systemd).
-API_KEY = os.getenv("OPENAI_API_KEY") or _keyring("revisor", "api-key")
-API_BASE= os.getenv("OPENAI_BASE", "https://api.openai.com/v1")
-ECHO    = os.getenv("REVISOR_ECHO", "0") == "1"  # also print revised text to stdout
+def whereis(cmd):
+    """Returns the absolute path of a command in the user's PATH (None if absent).
+    Only used to fill CFG at startup."""
+    return which(cmd)
 
-def log(msg):
-    """Appends a timestamped message to the log file ~/.revise.log."""
-    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {msg}\n")
+@dataclass(frozen=True)
+class Cfg:
+    """Run configuration: environment and tool paths, resolved once at startup."""
+    model: str
+    api_key: str | None
+    api_base: str
+    echo: bool              # also print revised text to stdout
+    debug: bool             # also log request text excerpts
+    session: str            # XDG_SESSION_TYPE, lowercased
+    display: str
+    xclip: str | None       # absolute paths of the clipboard tools (None if absent)
+    wl_paste: str | None
+    wl_copy: str | None
 
-def whereis(cmd):
-    """Checks if a command exists in the user's PATH."""
-    return subprocess.run(["bash","-lc", f"command -v {cmd} >/dev/null 2>&1"]).returncode == 0
+CFG = Cfg(
+    model    = os.getenv("REVISOR_MODEL", "gpt-5"),
+    # Secrets migrated from ~/.secrets to GNOME Keyring (2026-06): use the env var
+    # if set, else fetch from the keyring (service=revisor key=api-key). The keyring
+    # path works regardless of launch context (i3, shell, systemd).
+    api_key  = os.getenv("OPENAI_API_KEY") or _keyring("revisor", "api-key"),
+    api_base = os.getenv("OPENAI_BASE", "https://api.openai.com/v1"),
+    echo     = os.getenv("REVISOR_ECHO", "0") == "1",
+    debug    = os.getenv("REVISOR_DEBUG", "0") == "1",
+    session  = os.getenv("XDG_SESSION_TYPE", "").lower(),
+    display  = os.getenv("DISPLAY", ""),
+    xclip    = whereis("xclip"),
+    wl_paste = whereis("wl-paste"),
+    wl_copy  = whereis("wl-copy"),
+)
 
-def run(cmd, timeout=1.0, check=True, text=True, capture_output=True, stdin=None):
-    """Executes a command, captures its output, and handles errors."""
-    try:
-        return subprocess.run(cmd, timeout=timeout, check=check, text=text,
-                              capture_output=capture_output, input=stdin)
-    except TimeoutExpired:
-        log(f"TIMEOUT: {' '.join(cmd)}")
-        raise
-    except CalledProcessError as e:
-        log(f"NONZERO EXIT {e.returncode}: {' '.join(cmd)} | stderr={e.stderr!r}")
-        if check: raise
-        return e
+# Like curl, take a base without a scheme (e.g. localhost:8080/v1) as http://.
+_API_URL = (CFG.api_base if "://" in CFG.api_base else f"http://{CFG.api_base}").rstrip("/") + "/responses"
+
+class _DroppingQueueHandler(QueueHandler):
+    """Queue handler that stamps records with the microseconds elapsed since T0
+    and drops them when the queue is full instead of blocking."""
+    def prepare(self, record):
+        record.elapsed_us = (time.monotonic_ns() - T0) // 1000
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+class _BatchFileHandler(logging.FileHandler):
+    """File handler with a 64 KB buffer that is not flushed after every record;
+    the listener calls flush_now() once a burst of records has been written."""
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=1 << 16,
+                    encoding=self.encoding, newline="")
+
+    def flush(self):
+        pass  # called by emit() per record; closing the handler flushes the rest
+
+    def flush_now(self):
+        super().flush()
+
+class _BatchQueueListener(QueueListener):
+    """Queue listener that flushes its handlers whenever the queue runs empty,
+    so every line is on disk as soon as the main thread stops logging."""
+    def dequeue(self, block):
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush_now()
+        return self.queue.get(block)
+
+# log() only enqueues; a background listener thread writes to disk, so a slow
+# disk never sits between clipboard grab, LLM request and paste.
+_log_queue = queue.Queue(maxsize=4096)
+_log_file = _BatchFileHandler(LOG_FILE, encoding="utf-8")
+_log_file.setFormatter(logging.Formatter("[%(elapsed_us)10dus] %(message)s"))
+_log_listener = _BatchQueueListener(_log_queue, _log_file)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+_logger = logging.getLogger("revisor")
+_logger.setLevel(logging.DEBUG if CFG.debug else logging.INFO)
+_logger.propagate = False
+_logger.addHandler(_DroppingQueueHandler(_log_queue))
+
+def log(msg, *args):
+    """Appends a message stamped with the time since start to ~/.revisor.log (asynchronously).
+    Takes %-style args, so nothing is formatted for records that are filtered out."""
+    _logger.info(msg, *args)
+
+def _nonblank(s):
+    """Checks that a str or bytes has a non-whitespace character, without building a stripped copy.
+    On bytes only ASCII whitespace counts as blank."""
+    return bool(s) and not s.isspace()
+
+def run_all(cmds, timeout=1.0):
+    """Executes commands concurrently and returns their outputs as bytes (b"" on error or timeout)."""
+    procs = []
+    for cmd in cmds:
+        try:
+            procs.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE))
+        except OSError as e:
+            log("SPAWN FAILED: %s | %s", " ".join(cmd), e)
+            procs.append(None)
+    outs = []
+    for cmd, p in zip(cmds, procs):
+        out = b""
+        if p is not None:
+            try:
+                stdout, stderr = p.communicate(timeout=timeout)
+                if p.returncode == 0:
+                    out = stdout
+                else:
+                    log("NONZERO EXIT %d: %s | stderr=%r", p.returncode, " ".join(cmd), stderr)
+            except TimeoutExpired:
+                # Like subprocess.run: reap the process but don't wait for EOF on the
+                # pipes, which a child it forked may still hold open.
+                p.kill(); p.wait()
+                log("TIMEOUT: %s", " ".join(cmd))
+        outs.append(out)
+    return outs
 
 def read_prompt():
     """Reads the system prompt from ~/.revisor, or returns a default."""
     if PROMPT_FILE.exists():
         p = PROMPT_FILE.read_text(encoding="utf-8").strip()
-        log(f"Prompt loaded ({len(p)} chars)")
+        log("Prompt loaded (%d chars)", len(p))
         return p
     default = "Revise the text for clarity and concision. Preserve meaning. Keep same language. Plain text only."
     log("Prompt file missing; using default.")
     return default
 
-def grab_primary_x11():
-    """Captures text from the X11 primary selection (middle-click paste) using xclip."""
-    if whereis("xclip"):
-        try:
-            out = run(["xclip","-selection","primary","-o"], timeout=0.3)
-            text = out.stdout
-            log(f"PRIMARY grabbed: len={len(text)}")
-            return text
-        except Exception:
-            pass
-    return ""
-
-def grab_clipboard_x11():
-    """Captures text from the X11 clipboard (Ctrl+C/V) using xclip."""
-    if whereis("xclip"):
-        try:
-            out = run(["xclip","-selection","clipboard","-o"], timeout=0.3)
-            text = out.stdout
-            log(f"CLIPBOARD grabbed: len={len(text)}")
-            return text
-        except Exception:
-            pass
-    return ""
-
 def x11_capture():
     """Captures text from X11, prioritizing primary selection then clipboard, using xclip."""
-    # Order: PRIMARY → CLIPBOARD
-    text = grab_primary_x11()
-    if not text.strip():
-        text = grab_clipboard_x11()
-    log(f"Captured (X11) final len={len(text)}")
+    # Order: PRIMARY → CLIPBOARD. Both are read concurrently (PRIMARY is the
+    # middle-click selection, CLIPBOARD is Ctrl+C/V). Kept as raw bytes.
+    text = b""
+    xclip = CFG.xclip
+    if xclip:
+        primary, clipboard = run_all([[xclip,"-selection","primary","-o"],
+                                      [xclip,"-selection","clipboard","-o"]], timeout=0.3)
+        log("PRIMARY grabbed: bytes=%d", len(primary))
+        log("CLIPBOARD grabbed: bytes=%d", len(clipboard))
+        text = primary if _nonblank(primary) else clipboard
+    log("Captured (X11) final bytes=%d", len(text))
     return text
 
 def wayland_capture():
     """Captures text from the Wayland clipboard or primary selection using wl-paste."""
-    # Wayland: try clipboard/primary.
-    text = ""
-    if whereis("wl-paste"):
-        for args in (["wl-paste","--no-newline"], ["wl-paste","--primary","--no-newline"]):
-            try:
-                out = run(args, timeout=0.3)
-                if out.stdout.strip():
-                    text = out.stdout
-                    whereis_primary = "PRIMARY" if "--primary" in args else "CLIPBOARD"
-                    log(f"Wayland {whereis_primary} grabbed len={len(text)}")
-                    break
-            except Exception:
-                pass
-    log(f"Captured (Wayland) final len={len(text)}")
+    # Wayland: try clipboard/primary, both read concurrently. Kept as raw bytes.
+    text = b""
+    wl_paste = CFG.wl_paste
+    if wl_paste:
+        clipboard, primary = run_all([[wl_paste,"--no-newline"],
+                                      [wl_paste,"--primary","--no-newline"]], timeout=0.3)
+        for name, out in (("CLIPBOARD", clipboard), ("PRIMARY", primary)):
+            if _nonblank(out):
+                text = out
+                log("Wayland %s grabbed bytes=%d", name, len(text))
+                break
+    log("Captured (Wayland) final bytes=%d", len(text))
     return text
 
+def _parse_text(data):
+    """Extracts the revision from a top-level .text field (None if absent)."""
+    if isinstance(data.get("text"), str) and _nonblank(data["text"]):
+        return data["text"].strip()
+    return None
+
+def _parse_responses(data):
+    """Extracts the revision from a /responses output[*].content[*] list (None if absent)."""
+    if "output" in data and isinstance(data["output"], list):
+        chunks = []
+        for item in data["output"]:
+            for blk in item.get("content", []):
+                if blk.get("type") == "output_text":
+                    chunks.append(blk.get("text", ""))
+        return ("\n".join(chunks)).strip()
+    return None
+
+def _parse_chat(data):
+    """Extracts the revision from a Chat Completions choices[0] (None if absent)."""
+    if "choices" in data and data["choices"]:
+        return data["choices"][0]["message"]["content"].strip()
+    return None
+
+# Response shapes, in probing order: name -> (parser, log label).
+_PARSERS = {
+    "text":      (_parse_text, "from .text"),
+    "responses": (_parse_responses, "/responses"),
+    "chat":      (_parse_chat, "/chat"),
+}
+
+def _load_parse_cache():
+    """Reads the {endpoint: parser name} cache from ~/.revisor.cache.json ({} if unusable)."""
+    try:
+        cache = json.loads(CACHE_FILE.read_text(encoding="utf-8"))
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+_PARSE_CACHE = _load_parse_cache()
+
+def parse_response(data):
+    """Extracts the revised text from an API response, trying the shape cached for
+    this endpoint first. Returns None if no known shape matches."""
+    endpoint = f"{CFG.api_base} {CFG.model}"
+    cached = _PARSE_CACHE.get(endpoint)
+    # Stable sort: the cached parser moves to the front, the others keep their order.
+    for name in sorted(_PARSERS, key=lambda n: n != cached):
+        parser, label = _PARSERS[name]
+        try:
+            text = parser(data)
+        except (KeyError, IndexError, TypeError, AttributeError):
+            continue
+        if text is None:
+            continue
+        log("LLM text chars=%d (%s)", len(text), label)
+        if name != cached:
+            _PARSE_CACHE[endpoint] = name
+            try:
+                CACHE_FILE.write_text(json.dumps(_PARSE_CACHE), encoding="utf-8")
+            except OSError as e:
+                log("Cannot write %s: %s", CACHE_FILE, e)
+        return text
+    return None
+
 def ask_llm(system_prompt, user_text):
     """Sends text to a large language model for revision and returns the result."""
     in_len = len(user_text)
-    log_text = user_text[:500]
-    if in_len > 500:
-        log_text += "..."
-    log(f"LLM request: model={MODEL}, in_len={in_len}, text={log_text!r}")
-    headers = [
-        "Content-Type: application/json",
-        f"Authorization: Bearer {API_KEY}"
-    ]
+    log("LLM request: model=%s, chars=%d", CFG.model, in_len)
+    if CFG.debug:
+        log_text = user_text[:500]
+        if in_len > 500:
+            log_text += "..."
+        _logger.debug("LLM request text=%r", log_text)
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {CFG.api_key}"
+    }
     body = {
-        "model": MODEL,
+        "model": CFG.model,
         "input": [
             {"role":"system","content":system_prompt},
             {"role":"user","content":user_text}
         ]
     }
     try:
-        json_body = json.dumps(body)
-        curl_cmd = f'curl -sS -X POST "{API_BASE}/responses" -H "{headers[0]}" -H "{headers[1]}" -d @-'
-        out = run(["bash", "-lc", curl_cmd], timeout=120.0, stdin=json_body)
-        data = json.loads(out.stdout)
-        log(f"LLM response keys={list(data.keys())}")
-
-        if isinstance(data.get("text"), str) and data["text"].strip():
-            text = data["text"].strip()
-            log(f"LLM text len={len(text)} (from .text)")
-            return text
+        # Serialize straight to the bytes sent as the request body; no str copy is kept alive.
+        # Compact UTF-8 JSON: non-ASCII text is not inflated into \uXXXX escapes.
+        payload = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        # urllib honours http_proxy/https_proxy/no_proxy, as curl did.
+        req = urllib.request.Request(_API_URL, data=payload, headers=headers, method="POST")
+        try:
+            resp = urllib.request.urlopen(req, timeout=120.0)
+        except HTTPError as e:
+            resp = e  # error bodies carry the API's JSON error message
+        with resp:
+            data = json.loads(resp.read())
+        log("LLM response status=%d keys=%s", resp.status, list(data.keys()))
 
-        # Responses format
-        if "output" in data and isinstance(data["output"], list):
-            chunks = []
-            for item in data["output"]:
-                for blk in item.get("content", []):
-                    if blk.get("type") == "output_text":
-                        chunks.append(blk.get("text", ""))
-            text = ("\n".join(chunks)).strip()
-            log(f"LLM text len={len(text)} (/responses)")
-            return text
-        # Chat Completions fallback
-        if "choices" in data and data["choices"]:
-            text = data["choices"][0]["message"]["content"].strip()
-            log(f"LLM text len={len(text)} (/chat)")
+        text = parse_response(data)
+        if text is not None:
             return text
-        log(f"LLM response parse failed. Full response: {json.dumps(data)}")
+        log("LLM response parse failed. Full response: %s", json.dumps(data))
     except Exception as e:
-        log(f"LLM error: {e}")
+        log("LLM error: %s", e)
     return ""
 
 
@@ -168,70 +306,78 @@ def notify_i3bar():
     # Signal i3blocks to refresh (signal=3 → SIGRTMIN+3)
     subprocess.run(["pkill", "-RTMIN+3", "i3blocks"],
                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    # Schedule cleanup in background: sleep 5s, remove file, signal again
+    # Schedule cleanup in background: sleep 5s, remove file, signal again.
+    # Plain POSIX sh is enough to sequence this; no need to start bash.
     subprocess.Popen(
-        ["bash", "-c", "sleep 5; rm -f /tmp/revisor-notify; pkill -RTMIN+3 i3blocks"],
+        ["/bin/sh", "-c", "sleep 5; rm -f /tmp/revisor-notify; pkill -RTMIN+3 i3blocks"],
         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 
-def paste_x11(text):
-    """Pastes text to the X11 clipboard using xclip."""
+def paste_x11(data):
+    """Pastes UTF-8 bytes to the X11 clipboard using xclip."""
     # Load text to CLIPBOARD.
-    log(f"Paste (X11) len={len(text)}")
-    if whereis("xclip"):
-        p = subprocess.Popen(["xclip","-selection","clipboard","-in"], stdin=subprocess.PIPE, text=True)
-        p.communicate(text)
+    log("Paste (X11) bytes=%d", len(data))
+    xclip = CFG.xclip
+    if xclip:
+        p = subprocess.Popen([xclip,"-selection","clipboard","-in"], stdin=subprocess.PIPE)
+        p.communicate(data)
     else:
         log("xclip missing; cannot set clipboard")
 
-def paste_wayland(text):
-    """Pastes text to the Wayland clipboard using wl-copy."""
-    log(f"Paste (Wayland) len={len(text)}")
-    if whereis("wl-copy"):
-        p = subprocess.Popen(["wl-copy"], stdin=subprocess.PIPE, text=True)
-        p.communicate(text)
+def paste_wayland(data):
+    """Pastes UTF-8 bytes to the Wayland clipboard using wl-copy."""
+    log("Paste (Wayland) bytes=%d", len(data))
+    wl_copy = CFG.wl_copy
+    if wl_copy:
+        p = subprocess.Popen([wl_copy], stdin=subprocess.PIPE)
+        p.communicate(data)
+
+# The session does not change during a run: pick the backends once.
+_capture = wayland_capture if CFG.session == "wayland" and CFG.wl_paste else x11_capture
+_paste   = paste_wayland if CFG.session == "wayland" and CFG.wl_copy else paste_x11
 
 def capture():
     """Captures text from clipboard, trying Wayland then X11."""
-    session = os.getenv("XDG_SESSION_TYPE","").lower()
-    if session == "wayland" and whereis("wl-paste"):
-        return wayland_capture()
-    return x11_capture()
-
-def paste(text):
-    """Pastes text to clipboard, trying Wayland then X11."""
-    session = os.getenv("XDG_SESSION_TYPE","").lower()
-    if session == "wayland" and whereis("wl-copy"):
-        paste_wayland(text)
-    else:
-        paste_x11(text)
+    return _capture()
+
+def paste(data):
+    """Pastes UTF-8 bytes to clipboard, trying Wayland then X11."""
+    _paste(data)
 
 def main():
     """Main entry point: captures text, sends to LLM, and pastes the revision."""
-    if not API_KEY:
+    log("Start %s: session=%s, DISPLAY=%r, model=%s",
+        time.strftime("%Y-%m-%d %H:%M:%S"), CFG.session, CFG.display, CFG.model)
+    if not CFG.api_key:
         log("ERROR: OPENAI_API_KEY not set."); sys.exit(1)
-    session = os.getenv("XDG_SESSION_TYPE","").lower()
-    display = os.getenv("DISPLAY", "")
-    log(f"Start: session={session}, DISPLAY={display!r}, model={MODEL}")
 
     sys_prompt = read_prompt()
     src = capture()
 
-    if not src.strip():
+    # The only decode of the captured bytes; the blank check runs on the decoded
+    # text so Unicode whitespace (e.g. U+00A0) counts as blank, as with str.strip().
+    text = src.decode("utf-8", "replace")
+    if not _nonblank(text):
         log("No source text captured; abort."); sys.exit(0)
 
-    revised = ask_llm(sys_prompt, src)
-    notify_i3bar()
+    revised = ask_llm(sys_prompt, text)
 
-    if not revised.strip():
+    if _nonblank(revised):
+        out = revised.encode("utf-8")
+    else:
         log("LLM returned empty; fallback to source.")
-        revised = src
+        out = src  # still the raw captured bytes: no decode/encode round-trip
 
-    if ECHO:
-        print(revised)
+    if CFG.echo:
+        sys.stdout.buffer.write(out)
+        sys.stdout.buffer.write(b"\n")
 
-    paste(revised)
-    log("Done.")
+    # Notification and paste are independent: run them side by side.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        jobs = [pool.submit(notify_i3bar), pool.submit(paste, out)]
+    for job in jobs:
+        job.result()
+    log("Done %s.", time.strftime("%Y-%m-%d %H:%M:%S"))
 
 if __name__ == "__main__":
     """Handles script execution and graceful shutdown."""